@@ -1,42 +1,91 @@
-from os import path
+from os import path, makedirs
+import atexit
 import datetime
 import csv
+import sys
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
+from time import strftime, localtime
+from types import MappingProxyType
 from config.sources import *
 
+try:
+    import pyarrow
+    import pyarrow.csv as pyarrow_csv
+except ImportError:  # pyarrow is optional, the csv module is used without it
+    pyarrow = None
+
 START_TIME = str(datetime.datetime.now()).replace(':', '-')
 LOG_FILE_PATH = path.join(path.abspath(path.curdir), "logs", "log " + START_TIME + ".txt")
 
+# The log file is opened once and kept open for the whole run, then flushed and closed on exit
+makedirs(path.dirname(LOG_FILE_PATH), exist_ok=True)
+LOG_FILE = open(LOG_FILE_PATH, 'a', buffering=1 << 16)
+atexit.register(LOG_FILE.close)
+# Sources can be read on several threads at once, which all write to the same log file
+LOG_LOCK = threading.Lock()
+
+# Whether source csv files are parsed with pyarrow when it can read them, since it can't skip spaces after delimiters
+PYARROW_ENABLED = pyarrow is not None and not csv_skip_initial_space
+
+# The number of bytes pyarrow parses at a time, which bounds how much of a source csv is held in memory at once
+CSV_BLOCK_SIZE = 1 << 24
+
+# The buffer size used when reading and writing csv files, larger than the default to cut down on system calls
+FILE_BUFFER_SIZE = 1 << 20
+
 
 def write_to_log(message):
     """
     Writes a message with a timestamp to a log file in the /logs/ directory
+    Writes are buffered, so messages reach the file when the buffer fills or the program exits
     :param message: (str) the message to be recorded
     :return: None
     """
-    with open(LOG_FILE_PATH, 'a') as logf:
-        time = datetime.datetime.now()
-        logf.write(str(time) + " " + message)
-        logf.write('\n')
+    line = strftime("%Y-%m-%d %H:%M:%S ", localtime()) + message + "\n"
+    with LOG_LOCK:
+        LOG_FILE.write(line)
 
 
 def normalize(x):
     """
     Applies various changes to the given string to make it standardized in format
     Changes applied: make lowercase, remove leading and trailing whitespace
+    read_source_csv applies the same changes inline, so keep the two in sync
     :param x: (str) the string to be normalized
     :return: the normalized string
     """
     return x.lower().strip()
 
 
-def make_result_csv(source_name, source_data, csv_type, save_location=export_csv_path):
+def make_row_getter(fieldnames, fields_to_get):
+    """
+    Creates a function that picks the values of the given fields out of a row, in the order they are given
+    :param fieldnames: the fieldnames of the rows the function will be called on
+    :param fields_to_get: the fieldnames of the values to pick out
+    :return: a function of the form row -> (value, value, ...)
+    """
+    indices = [fieldnames.index(fieldname) for fieldname in fields_to_get]
+    if len(indices) == 1:  # itemgetter returns a bare value instead of a tuple for a single index
+        index = indices[0]
+        return lambda row: (row[index],)
+    return itemgetter(*indices)
+
+
+def make_result_csv(source_name, source_data, csv_type, save_location=export_csv_path, fieldnames=None):
     """
-    Creates a result csv file from a list of dictionary data given to it and saves it to the exports folder
+    Creates a result csv file from the rows given to it and saves it to the exports folder
     :param source_name: (str) the name of the source, used to differentiate export file names.
     Must not include characters that are not allowed in file names
-    :param source_data: (list) the dictionary data to be converted to csv
+    :param source_data: (iterable) the rows to be converted to csv, written as they are iterated over.
+    Each row is a tuple of values ordered like fieldnames, or a dictionary if fieldnames is not given
     :param csv_type: (str) the type of export, choose between "extra", "missingPK", "duplicate" and "differences"
     :param save_location: (str) the filepath to which the result will be saved
+    :param fieldnames: (tuple) the header of the csv file, taken from the keys of the first row if not given
     :return: None, but makes a csv file in the exports folder
     """
     write_to_log(f"writing {csv_type} csv file for {source_name}...")
@@ -44,16 +93,38 @@ def make_result_csv(source_name, source_data, csv_type, save_location=export_csv
     filename = source_name + " " + csv_type + " " + time + ".csv"
     filepath = path.join(save_location, filename)
 
-    with open(filepath, 'w', newline="") as f:
-        fieldnames = list(source_data[0].keys())
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+    if fieldnames is None:  # the rows are dictionaries, and the keys of the first one make the header
+        source_data = iter(source_data)
+        first_entry = next(source_data, None)
+        if first_entry is None:
+            message = f"ERROR: no entries to write to the {csv_type} csv file for {source_name}"
+            write_to_log(message)
+            raise ValueError(message)
+
+    with open(filepath, 'w', newline="", buffering=FILE_BUFFER_SIZE) as f:
+        if fieldnames is None:
+            writer = csv.DictWriter(f, fieldnames=list(first_entry.keys()))
+            writer.writeheader()
+            writer.writerow(first_entry)
+        else:
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+        writer.writerows(source_data)
+
 
-        writer.writeheader()
-        for entry in source_data:
-            writer.writerow(entry)
+def make_difference_labels(keys, source_1_name=source_1_name, source_2_name=source_2_name):
+    """
+    Creates the fieldnames used in difference entries for every key but the primary key
+    Building these once per comparison saves formatting them again for every difference entry
+    :param keys: the keys of the dictionaries that will be compared
+    :param source_1_name: (str) the name of source 1, by default the one given in config/sources.py
+    :param source_2_name: (str) the name of source 2, by default the one given in config/sources.py
+    :return: a list of tuples of the form [(key, key_in_1, key_in_2), ...]
+    """
+    return [(key, f"{key}-[{source_1_name}]", f"{key}-[{source_2_name}]") for key in keys if key != "primary_key"]
 
 
-def make_difference_entry(dict_1, dict_2, source_1_name=source_1_name, source_2_name=source_2_name):
+def make_difference_entry(dict_1, dict_2, source_1_name=source_1_name, source_2_name=source_2_name, labels=None):
     """
     Given two dictionaries with the same keys but different values, creates a difference entry for them
     Assumes both dictionaries have a "primary_key" key
@@ -61,6 +132,7 @@ def make_difference_entry(dict_1, dict_2, source_1_name=source_1_name, source_2_
     :param dict_2: (dict) the second dictionary to compare
     :param source_1_name: (str) the name of source 1, by default the one given in config/sources.py
     :param source_2_name: (str) the name of source 2, by default the one given in config/sources.py
+    :param labels: (list) the fieldnames created by make_difference_labels, built from dict_1 if not given
     :return: a dictionary of the form
     {primary_key: val, key1_in_1: val, key1_in_2: val, key2_in_1: val, key2_in_2: val, ...}
     """
@@ -69,44 +141,70 @@ def make_difference_entry(dict_1, dict_2, source_1_name=source_1_name, source_2_
         write_to_log(message)
         raise ValueError(message)
 
-    difference = {"primary_key": dict_1["primary_key"]}
-    for key in dict_1.keys():
-        if key == "primary_key":
-            continue
+    if labels is None:
+        labels = make_difference_labels(dict_1.keys(), source_1_name, source_2_name)
 
-        difference[f"{key}-[{source_1_name}]"] = dict_1[key]
-        try:
-            if dict_1[key] == dict_2[key]:
-                difference[f"{key}-[{source_2_name}]"] = "*same*"
-            else:
-                difference[f"{key}-[{source_2_name}]"] = dict_2[key]
-        except KeyError:
-            message = "ERROR: One of the sources is incorrectly formatted"
-            write_to_log(message)
-            raise ValueError(message)
+    difference = {"primary_key": dict_1["primary_key"]}
+    try:
+        for key, key_in_1, key_in_2 in labels:
+            value_1 = dict_1[key]
+            value_2 = dict_2[key]
+            difference[key_in_1] = value_1
+            difference[key_in_2] = "*same*" if value_1 == value_2 else value_2
+    except KeyError:
+        message = "ERROR: One of the sources is incorrectly formatted"
+        write_to_log(message)
+        raise ValueError(message)
 
     return difference
 
 
+def make_difference_row(entry_1, entry_2):
+    """
+    Given two entries with the same fields in the same order but different values, creates a difference row for them
+    The row holds the values make_difference_entry would, ordered like the fieldnames from make_difference_labels
+    :param entry_1: (tuple) the entry from source 1, starting with the primary key
+    :param entry_2: (tuple) the entry from source 2, with its values in the same order as entry_1
+    :return: a list of the form [primary_key, key1_in_1, key1_in_2, key2_in_1, key2_in_2, ...]
+    """
+    row = [entry_1[0]]
+    for value_1, value_2 in zip(islice(entry_1, 1, None), islice(entry_2, 1, None)):
+        row += (value_1, "*same*" if value_1 == value_2 else value_2)
+    return row
+
+
 def make_mapping_dict(mapping_csv_filepath, mode):
     """
     Given a csv file mapping the standard field names to the field names in imported csv files,
     creates a dictionary mapping source names to standard names for every standard/source value pair
+    Results are cached, so the file is only read again once it has been modified
     :param mapping_csv_filepath: the filepath to the mapping csv file
     :param mapping: (str) whether this is a translations csv file, or a mapping csv file
-    :return: a dictionary of the form {"source_name": "standard_name", ...}
+    :return: a read-only dictionary of the form {"source_name": "standard_name", ...}
     """
     if mode not in {"mapping", "translations"}:
         message = "ERROR: incorrect mode for make_mapping_dict"
         write_to_log(message)
         raise ValueError(message)
 
+    return _load_mapping_dict(mapping_csv_filepath, path.getmtime(mapping_csv_filepath), mode)
+
+
+@lru_cache(maxsize=None)
+def _load_mapping_dict(mapping_csv_filepath, modified_time, mode):
+    """
+    Reads the mapping csv file for make_mapping_dict
+    :param mapping_csv_filepath: the filepath to the mapping csv file
+    :param modified_time: (float) the modification time of the file, part of the cache key so changes are picked up
+    :param mode: (str) whether this is a translations csv file, or a mapping csv file
+    :return: a read-only dictionary of the form {"source_name": "standard_name", ...}
+    """
     write_to_log(f"Making {mode} dictionary...")
 
     mapping_dict = {}
 
     # Populate the mapping dictionary
-    with open(mapping_csv_filepath, 'r') as f:
+    with open(mapping_csv_filepath, 'r', newline="", buffering=FILE_BUFFER_SIZE) as f:
         reader = csv.reader(f, delimiter=csv_delimiter, skipinitialspace=csv_skip_initial_space)
         headers = next(reader)  # skip the headers
         for line in reader:
@@ -127,26 +225,40 @@ def make_mapping_dict(mapping_csv_filepath, mode):
 
     if mode == "mapping":
         # Ensure all primary keys are mapped
+        standard_names = set(mapping_dict.values())
         for key in primary_keys:
-            if key not in mapping_dict.values():
+            if key not in standard_names:
                 message = "ERROR: Missing a primary key as a standard mapping value in mapping csv"
                 write_to_log(message)
                 raise IOError(message)
 
     write_to_log(f"Completed {mode} dictionary")
-    return mapping_dict
+    return MappingProxyType(mapping_dict)
 
 
 def make_filtering_list(filtering_csv_filepath=filtering_csv_path):
     """
-    Creates a list of tuples that represent what to filter out of results from config/filtering.csv
+    Creates a dictionary that represents what to filter out of results from config/filtering.csv
+    Values are normalized so they can be compared directly against normalized entries
+    Results are cached, so the file is only read again once it has been modified
     :param filtering_csv_filepath: the filepath to the filtering csv file, by default the one given in config/sources.py
-    :return: A list of tuples of the form [(fieldname, value), (fieldname, value), ...]
+    :return: A read-only dictionary of frozensets of the form {fieldname: {value, value, ...}, ...}
+    """
+    return _load_filtering_dict(filtering_csv_filepath, path.getmtime(filtering_csv_filepath))
+
+
+@lru_cache(maxsize=None)
+def _load_filtering_dict(filtering_csv_filepath, modified_time):
+    """
+    Reads the filtering csv file for make_filtering_list
+    :param filtering_csv_filepath: the filepath to the filtering csv file
+    :param modified_time: (float) the modification time of the file, part of the cache key so changes are picked up
+    :return: A read-only dictionary of frozensets of the form {fieldname: {value, value, ...}, ...}
     """
     write_to_log("Making filtering list...")
-    filtering_list = []
+    filtering_dict = defaultdict(set)
 
-    with open(filtering_csv_filepath, 'r') as f:
+    with open(filtering_csv_filepath, 'r', newline="", buffering=FILE_BUFFER_SIZE) as f:
         reader = csv.reader(f, delimiter=csv_delimiter, skipinitialspace=csv_skip_initial_space)
         headers = next(reader)  # skip the headers
         for line in reader:
@@ -157,109 +269,190 @@ def make_filtering_list(filtering_csv_filepath=filtering_csv_path):
                 message = "ERROR: filtering csv not formatted properly"
                 write_to_log(message)
                 raise IndexError(message)
-            filtering_list.append((fieldname, value))
+            filtering_dict[fieldname].add(normalize(value))
 
     write_to_log("Completed filtering list")
-    return filtering_list
+    return MappingProxyType({fieldname: frozenset(values) for fieldname, values in filtering_dict.items()})
 
 
-def read_source_csv(source_csv_filepath, mapping_dict, translations_dict, filtering_list):
+def read_csv_headers(csv_filepath):
+    """
+    Reads the header row of a csv file
+    :param csv_filepath: the filepath to the csv file
+    :return: a list of the headers of the csv file
     """
-    Creates a python dictionary representation of the given source csv file
+    with open(csv_filepath, 'r', newline="") as f:
+        return next(csv.reader(f, delimiter=csv_delimiter, skipinitialspace=csv_skip_initial_space))
+
+
+def can_read_with_pyarrow(headers, headers_to_read):
+    """
+    Decides whether read_csv_rows will parse a csv file with pyarrow. It may still fall back to the csv module
+    partway through, if pyarrow rejects a row
+    :param headers: the headers of the csv file
+    :param headers_to_read: the headers of the columns that are needed from the csv file
+    :return: (bool) True if pyarrow will be used
+    """
+    # pyarrow can't count rows without any columns to read,
+    # and keeps the first of several columns with the same header, while the csv module keeps them all
+    return (PYARROW_ENABLED and any(header in headers_to_read for header in headers)
+            and len(set(headers)) == len(headers))
+
+
+def read_csv_rows(csv_filepath, headers_to_read):
+    """
+    Yields the rows of a csv file as sequences of strings, starting with the header row
+    If can_read_with_pyarrow allows it, the file is parsed in blocks of CSV_BLOCK_SIZE bytes by its csv reader and only
+    the columns in headers_to_read are kept. Otherwise, the file is read row by row with the csv module
+    :param csv_filepath: the filepath to the csv file
+    :param headers_to_read: the headers of the columns that are needed from the csv file
+    :return: a generator of rows, the first of which holds the headers
+    """
+    with open(csv_filepath, 'r', newline="", buffering=FILE_BUFFER_SIZE) as f:
+        reader = csv.reader(f, delimiter=csv_delimiter, skipinitialspace=csv_skip_initial_space)
+        headers = next(reader)
+        columns = [header for header in headers if header in headers_to_read]
+
+        if not can_read_with_pyarrow(headers, headers_to_read):
+            if PYARROW_ENABLED:
+                write_to_log(f"ERROR: pyarrow can't read the columns of {csv_filepath}, "
+                             f"reading it with the csv module instead")
+            yield headers
+            yield from filter(None, reader)  # skip blank lines, which pyarrow skips as well
+            return
+
+    headers_yielded = False
+    rows_yielded = 0
+    try:
+        batches = pyarrow_csv.open_csv(
+            csv_filepath,
+            read_options=pyarrow_csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+            # quoted values may hold newlines, which pyarrow has to look for so it doesn't split a row between blocks
+            parse_options=pyarrow_csv.ParseOptions(delimiter=csv_delimiter, newlines_in_values=True),
+            convert_options=pyarrow_csv.ConvertOptions(column_types={column: pyarrow.string() for column in columns},
+                                                       include_columns=columns))
+        yield batches.schema.names
+        headers_yielded = True
+        for batch in batches:
+            yield from zip(*(column.to_pylist() for column in batch.columns))
+            rows_yielded += batch.num_rows
+    except pyarrow.ArrowInvalid as error:
+        # pyarrow rejects rows the csv module accepts, such as rows with extra fields
+        write_to_log(f"ERROR: pyarrow could not parse {csv_filepath}, reading it with the csv module instead: {error}")
+    else:
+        return
+
+    # carry on from the first row pyarrow didn't yield. pyarrow skips blank lines, which are filtered out of the
+    # csv module's rows as well so both count rows the same way
+    with open(csv_filepath, 'r', newline="", buffering=FILE_BUFFER_SIZE) as f:
+        reader = csv.reader(f, delimiter=csv_delimiter, skipinitialspace=csv_skip_initial_space)
+        next(reader)
+        rows = islice(filter(None, reader), rows_yielded, None)
+        if headers_yielded:  # the rows have to match the columns pyarrow already yielded the headers of
+            yield from map(make_row_getter(headers, columns), rows)
+        else:
+            yield headers
+            yield from rows
+
+
+def read_source_csv(source_csv_filepath, mapping_dict, translations_dict, filtering_dict):
+    """
+    Creates a python representation of the given source csv file, with one tuple of values per entry
     Only includes headers mapped in config/mapping.csv. Standardizes header names.
     :param source_csv_filepath: the filepath to the source csv file
     :param mapping_dict: the mapping dictionary created from the mapping csv file
     :param translations_dict: the translation dictionary created from the translation csv file
-    :param filtering_list: the filtering list created from the filtering csv file
-    :return: a tuple holding three items:
-        source_dict: a dictionary of the form {pk_1: {"standard_name_1": value, ...}, pk_2: {...}}
+    :param filtering_dict: the filtering dictionary created from the filtering csv file
+    :return: a tuple holding four items:
+        entries: a list of tuples of the form [(pk_1, value, ...), (pk_2, value, ...), ...] sorted by primary key,
             where the primary_keys are determined by config/sources.py
-        missing_pks: a list of dictionaries of the form [{"standard_name_1": value, ...}, {"standard_name_2": value, ...}]
-            representing the entries that are missing pk values
-        duplicates: a dictionary of dictionaries of the form {pk_1: [{"standard_name_1": value, ...}, {...}, ...], pk_2: [{...}, {...}, ...]}
-            representing the pk's that have duplicate entries
-
+        missing_pks: a list of tuples of the same form representing the entries that are missing pk values
+        duplicates: a list of tuples of the same form representing the entries whose pk's have duplicate entries
+        fieldnames: a tuple of the form ("primary_key", "standard_name_1", ...) naming the values in every entry
     """
     write_to_log(f"Reading source csv {source_csv_filepath}...")
-    entries = []
+    entries_by_pk = {}
     missing_pks = []
     duplicates = []
-    seen_pks = set()
-    headers_to_compare = []
+    duplicated_pks = set()
+    columns_to_compare = {}
     pk_indices = []
+    primary_key_set = set(primary_keys)
 
-    with open(source_csv_filepath, 'r') as f:
-        reader = csv.reader(f, delimiter=csv_delimiter, skipinitialspace=csv_skip_initial_space)
+    reader = read_csv_rows(source_csv_filepath, mapping_dict)
 
-        # build the list of headers that we care about
-        headers = next(reader)
-        # Find where the primary key is in the headers
-        for idx, header in enumerate(headers):
-            if header in mapping_dict:
-                if mapping_dict[header] in primary_keys:  # skip the primary keys
-                    pk_indices.append(idx)
-                    continue
-                headers[idx] = mapping_dict[header]
-                headers_to_compare.append((header, idx))
-
-        # build the source list
-        write_to_log("Populating intermediate structures...")
-        for entry in reader:
-            entry_dict = {}
-
-            # build the primary key
-            pk = ""
-            for pk_idx in pk_indices:
-                pk = pk + entry[pk_idx] + " "
-            entry_dict["primary_key"] = normalize(pk)
-
-            for item in headers_to_compare:
-                header = item[0]
-                header_idx = item[1]
-                value = entry[header_idx]
-                if value in translations_dict:
-                    entry_dict[headers[header_idx]] = normalize(translations_dict[value])
-                else:
-                    entry_dict[headers[header_idx]] = normalize(value)
-
-            # Decide whether to filter this entry out of the final results
-            ignore = False
-            for item in filtering_list:
-                fieldname = item[0]
-                value = item[1]
-                if entry_dict[fieldname] == value:
-                    ignore = True
-            if ignore:
+    # build the list of headers that we care about
+    headers = next(reader)
+    # Find where the primary key is in the headers
+    for idx, header in enumerate(headers):
+        if header in mapping_dict:
+            if mapping_dict[header] in primary_key_set:  # skip the primary keys
+                pk_indices.append(idx)
                 continue
+            # if several headers map to the same standard name, the last one is used
+            columns_to_compare[mapping_dict[header]] = idx
+
+    fieldnames = ("primary_key", *columns_to_compare)
+    # primary key columns are only kept joined together, as "primary_key", so they can't be filtered on either.
+    # A filter on a field the source doesn't have is only an error once there is an entry to filter
+    unknown_fields = [fieldname for fieldname in filtering_dict if fieldname not in fieldnames]
+    if unknown_fields and next(reader, None) is not None:
+        message = (f"ERROR: filtering csv filters on {unknown_fields[0]}, "
+                   f"which is not a compared field of {source_csv_filepath}")
+        write_to_log(message)
+        raise KeyError(message)
+    filters = tuple((fieldnames.index(fieldname), frozenset(values))
+                    for fieldname, values in filtering_dict.items() if fieldname in fieldnames)
+
+    # build the primary key from its columns. Most sources have a single primary key column, which needs no joining
+    if len(pk_indices) == 1:
+        get_pk = itemgetter(pk_indices[0])
+    elif pk_indices:
+        get_pk_values = itemgetter(*pk_indices)
+        get_pk = lambda entry: " ".join(get_pk_values(entry))
+    else:  # the source has none of the primary key columns
+        get_pk = lambda entry: ""
+
+    # bind everything used on every row to locals to keep lookups out of the row loop
+    translate = translations_dict.get
+    intern = sys.intern
+    value_indices = tuple(columns_to_compare.values())
+
+    # build the source list
+    write_to_log("Populating intermediate structures...")
+    for entry in reader:
+        pk = get_pk(entry)
+        # values are normalized inline rather than through normalize() to save a function call per cell.
+        # Primary keys are interned so that matching keys from the two sources are usually the same object
+        row = [intern(pk.lower().strip())]
+        for idx in value_indices:
+            value = entry[idx]
+            row.append(translate(value, value).lower().strip())
+        row = tuple(row)
+
+        # Decide whether to filter this entry out of the final results
+        if any(row[idx] in values for idx, values in filters):
+            continue
 
-            # populate the entry list
-            if pk == "" or pk.isspace():  # if the entry is missing values for all primary keys
-                missing_pks.append(entry_dict)
-            else:
-                pk = normalize(pk)
-                if pk in seen_pks:  # catch duplicate entries
-                    duplicates.append(entry_dict)
-
-                    if pk in {x['primary_key'] for x in entries}:
-                        to_delete = [x for x in entries if x['primary_key'] == pk]
-                        if len(to_delete) == 1:  # There should only be one item with the above property
-                            item_to_delete = to_delete[0]
-                            duplicates.append(item_to_delete)
-                            entries.remove(item_to_delete)
-                        else:
-                            message = "Something went wrong with the formatting of this source"
-                            write_to_log(message)
-                            raise IndexError(message)
-                else:
-                    seen_pks.add(pk)
-                    entries.append(entry_dict)
+        # populate the entry list
+        pk = row[0]
+        if not pk:  # if the entry is missing values for all primary keys
+            missing_pks.append(row)
+        elif pk in duplicated_pks:  # the pk has already been moved to duplicates
+            duplicates.append(row)
+        elif pk in entries_by_pk:  # catch duplicate entries
+            duplicates.append(row)
+            duplicates.append(entries_by_pk.pop(pk))
+            duplicated_pks.add(pk)
+        else:
+            entries_by_pk[pk] = row
 
     # sort results alphabetically by primary key
-    entries.sort(key=lambda x: x['primary_key'])
-    duplicates.sort(key=lambda x: x['primary_key'])
+    entries = sorted(entries_by_pk.values(), key=itemgetter(0))
+    duplicates.sort(key=itemgetter(0))
 
     write_to_log(f"Completed reading {source_csv_filepath}")
-    return entries, missing_pks, duplicates
+    return entries, missing_pks, duplicates, fieldnames
 
 
 def compare_sources(source_1_name=source_1_name, source_2_name=source_2_name,
@@ -290,60 +483,87 @@ def compare_sources(source_1_name=source_1_name, source_2_name=source_2_name,
     write_to_log(f"Reading {source_1_name} and {source_2_name}...")
     mapping_dict = make_mapping_dict(mapping_csv_filepath, mode="mapping")
     translations_dict = make_mapping_dict(translations_csv_filepath, mode="translations")
-    filtering_list = make_filtering_list(filtering_csv_filepath)
-    source_1_entries, source_1_missingPK, source_1_duplicates = \
-        read_source_csv(source_1_filepath, mapping_dict, translations_dict, filtering_list)
-    source_2_entries, source_2_missingPK, source_2_duplicates = \
-        read_source_csv(source_2_filepath, mapping_dict, translations_dict, filtering_list)
+    filtering_dict = make_filtering_list(filtering_csv_filepath)
+
+    # When pyarrow parses both sources, they are read on two threads so one can tokenize while the other runs
+    # the row loop. Only pyarrow's tokenizing releases the GIL, so that is all that can overlap.
+    # Threads are used over processes because pickling the entries back costs about as much as parsing them
+    if all(can_read_with_pyarrow(read_csv_headers(filepath), mapping_dict)
+           for filepath in (source_1_filepath, source_2_filepath)):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            source_1_future = executor.submit(read_source_csv, source_1_filepath,
+                                              mapping_dict, translations_dict, filtering_dict)
+            source_2_future = executor.submit(read_source_csv, source_2_filepath,
+                                              mapping_dict, translations_dict, filtering_dict)
+            source_1_result = source_1_future.result()
+            source_2_result = source_2_future.result()
+    else:
+        source_1_result = read_source_csv(source_1_filepath, mapping_dict, translations_dict, filtering_dict)
+        source_2_result = read_source_csv(source_2_filepath, mapping_dict, translations_dict, filtering_dict)
+    source_1_entries, source_1_missingPK, source_1_duplicates, source_1_fieldnames = source_1_result
+    source_2_entries, source_2_missingPK, source_2_duplicates, source_2_fieldnames = source_2_result
+
     source_1_extra = []
     source_2_extra = []
-    differences = []
-
-    source_1_entries_copy = [x.copy() for x in source_1_entries]
-    source_2_entries_copy = [x.copy() for x in source_2_entries]
+    mismatches = []
+
+    # source 2 entries are put in the same field order as source 1 entries before comparing them.
+    # If source 2 lacks some of the fields of source 1, the sources can't be compared, which is only an error
+    # once an entry is found in both of them
+    if source_1_fieldnames == source_2_fieldnames:
+        reorder = tuple  # returns the tuple it is given
+    elif set(source_1_fieldnames) <= set(source_2_fieldnames):
+        reorder = make_row_getter(source_2_fieldnames, source_1_fieldnames)
+    else:
+        reorder = None
+    # index source 2 by primary key so every source 1 entry can be matched in constant time
+    source_2_index = {x[0]: x for x in source_2_entries}
 
     write_to_log(f"Comparing {source_1_name} and {source_2_name}...")
-    for entry in source_1_entries_copy:
-        entry_pk = entry['primary_key']
-        matches = [x for x in source_2_entries_copy if x['primary_key'] == entry_pk]
-        if len(matches) > 1:
-            write_to_log("ERROR: Something went wrong when searching for duplicates")
-        elif len(matches) == 0:  # the entry is missing from source 2
+    for entry in source_1_entries:
+        match = source_2_index.pop(entry[0], None)
+        if match is None:  # the entry is missing from source 2
             source_1_extra.append(entry)
-        else:  # the entry exists in both
-            match = matches[0]
-            if entry != match:
-                differences.append(make_difference_entry(entry, match))
-
-            source_1_entries.remove(entry)
-            source_2_entries.remove(match)
+        elif reorder is None:
+            message = "ERROR: One of the sources is incorrectly formatted"
+            write_to_log(message)
+            raise ValueError(message)
+        else:
+            match = reorder(match)
+            if entry != match:  # the entry exists in both, but the values differ
+                mismatches.append((entry, match))
 
-    # now, every entry left in source_2_entries is extra to source 2
-    source_2_extra.extend(source_2_entries)
+    # now, every entry left in source_2_index is extra to source 2
+    source_2_extra.extend(source_2_index.values())
 
     write_to_log("Creating csv files...")
     # Create "missingPK" csv files if the missingPK lists are populated
     if len(source_1_missingPK) > 0:
-        make_result_csv(source_1_name, source_1_missingPK, "missingPK")
+        make_result_csv(source_1_name, source_1_missingPK, "missingPK", fieldnames=source_1_fieldnames)
     if len(source_2_missingPK) > 0:
-        make_result_csv(source_2_name, source_2_missingPK, "missingPK")
+        make_result_csv(source_2_name, source_2_missingPK, "missingPK", fieldnames=source_2_fieldnames)
 
     # Create "duplicates" csv files if the duplicates lists are populated
     if len(source_1_duplicates) > 0:
-        make_result_csv(source_1_name, source_1_duplicates, "duplicates")
+        make_result_csv(source_1_name, source_1_duplicates, "duplicates", fieldnames=source_1_fieldnames)
     if len(source_2_duplicates) > 0:
-        make_result_csv(source_2_name, source_2_duplicates, "duplicates")
+        make_result_csv(source_2_name, source_2_duplicates, "duplicates", fieldnames=source_2_fieldnames)
 
     # make the "extra" csv files if the extra lists are populated
     if len(source_1_extra) > 0:
-        make_result_csv(source_1_name, source_1_extra, "extra")
+        make_result_csv(source_1_name, source_1_extra, "extra", fieldnames=source_1_fieldnames)
     if len(source_2_extra) > 0:
-        make_result_csv(source_2_name, source_2_extra, "extra")
+        make_result_csv(source_2_name, source_2_extra, "extra", fieldnames=source_2_fieldnames)
 
-    # make the "differences" csv file if the differences list is populated
-    if len(differences) > 0:
+    # make the "differences" csv file if any entries differ. Difference rows are
+    # made one at a time as they are written so they are never all held in memory
+    if len(mismatches) > 0:
         name = source_1_name + " " + source_2_name
-        make_result_csv(name, differences, "differences")
+        fieldnames = ["primary_key"]
+        for _, key_in_1, key_in_2 in make_difference_labels(source_1_fieldnames, source_1_name, source_2_name):
+            fieldnames += [key_in_1, key_in_2]
+        differences = (make_difference_row(entry, match) for entry, match in mismatches)
+        make_result_csv(name, differences, "differences", fieldnames=fieldnames)
 
     write_to_log("Comparison complete!")
 
@@ -0,0 +1,118 @@
+import argparse
+import cProfile
+import pstats
+import sys
+import time
+from os import path
+from main import *
+
+try:
+    import resource
+except ImportError:  # resource is only available on unix
+    resource = None
+
+try:
+    from line_profiler import LineProfiler
+except ImportError:  # line_profiler is optional, only needed for --line-profiler
+    LineProfiler = None
+
+
+def peak_memory_mb():
+    """
+    Finds the peak resident memory of this process so far
+    :return: (float) the peak memory in megabytes, or None if it can't be measured on this platform
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def time_call(function, *args, **kwargs):
+    """
+    Calls a function and measures how long it takes
+    :param function: the function to call
+    :return: a tuple of the form (result, wall_time, cpu_time), with both times in seconds
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+
+def report_timing(label, wall_time, cpu_time, input_bytes):
+    """
+    Prints the throughput of a step, and whether it looks bound by the cpu or by waiting on i/o
+    A step that spent most of its wall time on the cpu is cpu bound, otherwise it was mostly waiting on i/o
+    :param label: (str) the name of the step
+    :param wall_time: (float) the wall time of the step in seconds
+    :param cpu_time: (float) the cpu time of the step in seconds, across all threads
+    :param input_bytes: (int) the number of bytes of source csv read by the step
+    :return: None
+    """
+    megabytes = input_bytes / (1 << 20)
+    throughput = megabytes / wall_time if wall_time > 0 else float("inf")
+    bound = "cpu" if cpu_time >= 0.8 * wall_time else "i/o"
+    print(f"{label}: {wall_time:.3f}s wall, {cpu_time:.3f}s cpu, {megabytes:.2f} MB at {throughput:.2f} MB/s "
+          f"-> looks {bound} bound")
+
+
+def profile_run(profile_output, top, line_profile):
+    """
+    Profiles a full comparison of the sources given in config/sources.py
+    Reads each source on its own first to time parsing separately from the comparison, then runs compare_sources,
+    which writes a full set of result csv files to the exports folder on every run, like a normal run does.
+    Both are run under cProfile. compare_sources may read the sources on worker threads, which cProfile can't see,
+    so only the separate reads show their details
+    :param profile_output: the filepath to which the cProfile stats will be saved
+    :param top: (int) the number of functions to print, sorted by cumulative time
+    :param line_profile: (bool) whether to also profile read_source_csv line by line with line_profiler
+    :return: None
+    """
+    source_1_bytes = path.getsize(source_1_path)
+    source_2_bytes = path.getsize(source_2_path)
+    memory_before = peak_memory_mb()
+
+    mapping_dict = make_mapping_dict(mapping_csv_path, mode="mapping")
+    translations_dict = make_mapping_dict(translations_csv_path, mode="translations")
+    filtering_dict = make_filtering_list(filtering_csv_path)
+
+    profiler = cProfile.Profile()
+    for name, filepath, input_bytes in ((source_1_name, source_1_path, source_1_bytes),
+                                        (source_2_name, source_2_path, source_2_bytes)):
+        _, wall_time, cpu_time = time_call(profiler.runcall, read_source_csv,
+                                           filepath, mapping_dict, translations_dict, filtering_dict)
+        report_timing(f"read_source_csv {name}", wall_time, cpu_time, input_bytes)
+
+    _, wall_time, cpu_time = time_call(profiler.runcall, compare_sources)
+    report_timing("compare_sources", wall_time, cpu_time, source_1_bytes + source_2_bytes)
+
+    memory_after = peak_memory_mb()
+    if memory_after is not None:
+        print(f"peak memory: {memory_before:.1f} MB before, {memory_after:.1f} MB after")
+
+    profiler.dump_stats(profile_output)
+    print(f"cProfile stats saved to {profile_output}")
+    pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+
+    if line_profile:
+        if LineProfiler is None:
+            print("line_profiler is not installed, skipping the line by line profile")
+            return
+        line_profiler = LineProfiler(read_source_csv)
+        line_profiler.runcall(read_source_csv, source_1_path, mapping_dict, translations_dict, filtering_dict)
+        line_profiler.print_stats()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Profiles compare_sources on the sources given in config/sources.py")
+    parser.add_argument("--output", default="compare_sources.prof",
+                        help="the filepath to which the cProfile stats will be saved")
+    parser.add_argument("--top", type=int, default=30,
+                        help="the number of functions to print, sorted by cumulative time")
+    parser.add_argument("--line-profiler", action="store_true",
+                        help="also profile read_source_csv line by line, requires line_profiler")
+    args = parser.parse_args()
+
+    profile_run(args.output, args.top, args.line_profiler)